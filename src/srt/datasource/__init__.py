@@ -1,6 +1,5 @@
 import configparser
 import logging
-from copy import deepcopy
 
 import srt
 
@@ -11,6 +10,8 @@ parent_config = srt.config
 default_config = {
     "tushare": {
         "token": "",
+        "symbol_list_ttl": "86400",  # seconds
+        "calls_per_minute": "480",  # below the 500 calls/min quota of daily
     },
 }
 
@@ -1,10 +1,10 @@
 import logging
 from datetime import datetime, timedelta
-from zoneinfo import ZoneInfo
 
 import click
 
 from srt.datasource import config
+from srt.utils import set_timezone
 
 logger = logging.getLogger(__name__)
 
@@ -74,20 +74,22 @@ def reset_db_or_tables(reset_db, reset_tables):
 @click.option(
     "--start-at",
     prompt="Start At (YYYY-MM-DD:hh:mm:ss)",
+    type=click.DateTime(formats=["%Y-%m-%d:%H:%M:%S"]),
     help="The start timestamp for the data update in YYYY-MM-DD:hh:mm:ss format.",
     default=lambda: datetime(1980, 1, 1).strftime("%Y-%m-%d:%H:%M:%S"),
 )
 @click.option(
     "--stop-at",
     prompt="Stop At (YYYY-MM-DD:hh:mm:ss)",
+    type=click.DateTime(formats=["%Y-%m-%d:%H:%M:%S"]),
     help="The end timestamp for the data update in YYYY-MM-DD:hh:mm:ss format.",
     default=lambda: datetime.now().strftime("%Y-%m-%d:%H:%M:%S"),
 )
 def download(biz_key, symbols, start_at, stop_at):
     from srt.datasource.downloader import download
 
-    start_at = set_timezone(start_at)
-    stop_at = set_timezone(stop_at)
+    start_at = set_timezone(start_at, config)
+    stop_at = set_timezone(stop_at, config)
 
     symbols = [s.strip() for s in symbols.split(",")] if symbols else []
 
@@ -95,11 +97,6 @@ def download(biz_key, symbols, start_at, stop_at):
     click.echo(f"Data update for biz_key '{biz_key}' completed up to {stop_at}.")
 
 
-def set_timezone(start_at):
-    start_at = start_at.replace(tzinfo=ZoneInfo(config.get("app", "timezone")))
-    return start_at
-
-
 # Get or Set configuration
 @cli.command(name="config")
 @click.argument("section_option", required=False)
@@ -108,58 +105,11 @@ def set_timezone(start_at):
     required=False,
 )
 def config_(section_option, value):
-    import configparser
-
     from srt.datasource import config as _config
     from srt.datasource import config_dir, config_file
+    from srt.utils import get_or_set_config
 
-    if value is None:
-        if section_option:
-            if "." in section_option:
-                section, option = section_option.split(".", 1)
-            else:
-                section, option = "default", section_option
-            if _config.has_section(section) and _config.has_option(section, option):
-                current_value = _config.get(section, option)
-                click.echo(f"{section}.{option} = {current_value}")
-            else:
-                click.echo(f"Configuration '{section}.{option}' not found.")
-        else:
-            for section in _config.sections():
-                click.echo(f"[{section}]")
-                for option in _config.options(section):
-                    value = _config.get(section, option)
-                    click.echo(f"{option} = {value}")
-                click.echo()
-    else:
-        if section_option:
-            if "." in section_option:
-                section, option = section_option.split(".", 1)
-            else:
-                section, option = "default", section_option
-            if not _config.has_section(section):
-                click.echo(f"Section '{section}' does not exist.")
-                return
-            if not _config.has_option(section, option):
-                click.echo(f"Option '{option}' does not exist in section '{section}'.")
-                return
-
-            config_in_file = configparser.ConfigParser()
-            if not config_dir.exists():
-                config_dir.mkdir(parents=True, exist_ok=True)
-            else:
-                config_in_file.read(config_file)
-            if not config_in_file.has_section(section):
-                config_in_file.add_section(section)
-            config_in_file.set(section, option, value)
-            with open(config_file, "w") as f:
-                config_in_file.write(f)
-
-            click.echo(f"Set {section}.{option} = {value} and saved to {config_file}")
-        else:
-            click.echo(
-                "Please specify the configuration option to set in 'section.option' format."
-            )
+    get_or_set_config(_config, config_dir, config_file, section_option, value)
 
 
 @cli.command()
@@ -173,7 +123,7 @@ def config_(section_option, value):
     required=True,
     type=click.DateTime(formats=["%Y-%m-%d:%H:%M:%S"]),
     help="Start date in YYYY-MM-DD format",
-    default=(datetime.now() - timedelta(days=30)).strftime(
+    default=lambda: (datetime.now() - timedelta(days=30)).strftime(
         "%Y-%m-%d:%H:%M:%S"
     ),  # default to last 30 days
 )
@@ -182,13 +132,13 @@ def config_(section_option, value):
     required=True,
     type=click.DateTime(formats=["%Y-%m-%d:%H:%M:%S"]),
     help="End date in YYYY-MM-DD format",
-    default=datetime.now().strftime("%Y-%m-%d:%H:%M:%S"),
+    default=lambda: datetime.now().strftime("%Y-%m-%d:%H:%M:%S"),
 )
 def show(provider, dataset, symbol, start_at, end_at):
     from srt.datasource.datasource import TushareDatasource
 
-    start_at = set_timezone(start_at)
-    end_at = set_timezone(end_at)
+    start_at = set_timezone(start_at, config)
+    end_at = set_timezone(end_at, config)
 
     ds_map = {
         "tushare": {
@@ -3,11 +3,10 @@ from abc import ABC, abstractmethod
 from datetime import datetime
 
 import pandas as pd
-import psycopg
 
 logger = logging.getLogger(__name__)
 
-from .dbtools import DB_NAME, get_conn_str
+from .dbtools import get_connection
 
 
 class Datasource(ABC):
@@ -33,54 +32,48 @@ class TushareDatasource(Datasource):
         except Exception as e:
             logger.warning(f"Error downloading data: {e}")
 
-        with psycopg.connect(get_conn_str(DB_NAME)) as conn:
-            with conn.cursor() as cur:
-                query = """
-                SELECT * FROM raw_data
-                WHERE biz_key = %s AND symbol = %s
-                AND tstzrange && tstzrange(%s, %s, '[)')
-                ORDER BY tstzrange
-                """
-                cur.execute(query, ("tushare_daily", symbol, start_at, end_at))
-                rows = cur.fetchall()
-                if not rows:
-                    raise ValueError(
-                        f"No data found for symbol {symbol} between {start_at} and {end_at}"
-                    )
-                records = [
-                    {
-                        "trade_date": datetime.strptime(
-                            row[4]["trade_date"], r"%Y%m%d"
-                        ),
-                        "Open": row[4]["open"],
-                        "High": row[4]["high"],
-                        "Low": row[4]["low"],
-                        "Close": row[4]["close"],
-                        "Volume": row[4]["vol"],
-                    }
-                    for row in rows
-                ]
-
-                df = pd.DataFrame.from_records(
-                    records,
-                    columns=["trade_date", "Open", "High", "Low", "Close", "Volume"],
+        with get_connection().cursor() as cur:
+            # project only the needed fields, not the whole JSONB document
+            query = """
+            SELECT
+                data->>'trade_date',
+                (data->>'open')::float8,
+                (data->>'high')::float8,
+                (data->>'low')::float8,
+                (data->>'close')::float8,
+                (data->>'vol')::float8
+            FROM raw_data
+            WHERE biz_key = %s AND symbol = %s
+            AND tstzrange && tstzrange(%s, %s, '[)')
+            ORDER BY tstzrange
+            """
+            cur.execute(query, ("tushare_daily", symbol, start_at, end_at))
+            rows = cur.fetchall()
+            if not rows:
+                raise ValueError(
+                    f"No data found for symbol {symbol} between {start_at} and {end_at}"
                 )
+            df = pd.DataFrame.from_records(
+                rows,
+                columns=["trade_date", "Open", "High", "Low", "Close", "Volume"],
+            )
 
-                df.set_index("trade_date", inplace=True)
-                df.index = pd.to_datetime(df.index, format=r"%Y%m%d")
-                df.sort_index(inplace=True)
+            df.set_index("trade_date", inplace=True)
+            # parse all trade dates in one vectorised call
+            df.index = pd.to_datetime(df.index, format=r"%Y%m%d")
+            df.sort_index(inplace=True)
 
-                logger.debug(
-                    """
-                Retrieved %d rows for symbol %s between %s and %s
-                Data sample:
-                %s
-                """,
-                    len(df),
-                    symbol,
-                    start_at,
-                    end_at,
-                    df.head(),
-                )
+            logger.debug(
+                """
+            Retrieved %d rows for symbol %s between %s and %s
+            Data sample:
+            %s
+            """,
+                len(df),
+                symbol,
+                start_at,
+                end_at,
+                df.head(),
+            )
 
-                return df
+            return df
@@ -1,10 +1,10 @@
 # Utility to check which (biz_key, symbol, timestamp) pairs are missing from raw_data
 import logging
+from collections import defaultdict
 from datetime import datetime
 from typing import Any, List, Optional, Tuple
 
 import psycopg
-from rich.logging import RichHandler
 
 from . import config
 
@@ -29,6 +29,42 @@ def get_conn_str(db: Optional[str] = None) -> str:
     return " ".join([f"{k}={v}" for k, v in conn_info.items()])
 
 
+_conn: Optional[psycopg.Connection] = None
+
+
+def get_connection() -> psycopg.Connection:
+    """Return the connection to DB_NAME shared by the process, reconnect if it is closed.
+
+    The connection is in autocommit mode, use `with conn.transaction():` to group statements.
+    The first connection of the process also drops the redundant indexes left in the database.
+    """
+    global _conn
+    if _conn is None:
+        _conn = psycopg.connect(get_conn_str(DB_NAME), autocommit=True)
+        drop_redundant_indexes(_conn)
+    elif _conn.closed:
+        _conn = psycopg.connect(get_conn_str(DB_NAME), autocommit=True)
+    return _conn
+
+
+def drop_redundant_indexes(conn: psycopg.Connection):
+    """Drop the indexes duplicated by the UNIQUE constraints.
+
+    reset_tables no longer creates them, but databases created before still have them.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            DROP INDEX IF EXISTS
+                idx_raw_data_biz_key,
+                idx_raw_data_biz_key_symbol,
+                idx_raw_data_biz_symbol_start_at,
+                idx_raw_data_coverage_biz_key,
+                idx_raw_data_coverage_biz_key_symbol;
+            """
+        )
+
+
 # reset table
 def reset_tables():
 
@@ -50,10 +86,10 @@ def reset_tables():
                     CONSTRAINT raw_data_enforce_bounds CHECK (lower_inc(tstzrange) AND NOT upper_inc(tstzrange)),
                     UNIQUE(biz_key, symbol, tstzrange)
                 );
-                CREATE INDEX IF NOT EXISTS idx_raw_data_biz_key ON raw_data(biz_key);
-                CREATE INDEX IF NOT EXISTS idx_raw_data_biz_key_symbol ON raw_data(biz_key, symbol);
+                -- The UNIQUE constraint already provides a btree index on
+                -- (biz_key, symbol, tstzrange), which also serves lookups on
+                -- biz_key and (biz_key, symbol).
                 CREATE INDEX IF NOT EXISTS idx_raw_data_biz_start_at ON raw_data(biz_key, tstzrange);
-                CREATE INDEX IF NOT EXISTS idx_raw_data_biz_symbol_start_at ON raw_data(biz_key, symbol, tstzrange);
                 """
             )
             # Create a raw_data_coverage table to track the coverage of data for each (biz_key, symbol)
@@ -73,8 +109,6 @@ def reset_tables():
                     CONSTRAINT raw_data_coverage_enforce_bounds CHECK (lower_inc(tstzrange) AND NOT upper_inc(tstzrange)),
                     UNIQUE(biz_key, symbol, tstzrange)
                 );
-                CREATE INDEX IF NOT EXISTS idx_raw_data_coverage_biz_key ON raw_data_coverage(biz_key);
-                CREATE INDEX IF NOT EXISTS idx_raw_data_coverage_biz_key_symbol ON raw_data_coverage(biz_key, symbol);
                 """
             )
             conn.commit()
@@ -83,6 +117,10 @@ def reset_tables():
 # reset database and tables
 def reset_database():
 
+    # DROP DATABASE fails while the shared connection is still open
+    if _conn is not None:
+        _conn.close()
+
     url = get_conn_str(f"postgres")
     with psycopg.connect(url, autocommit=True) as conn:
         with conn.cursor() as cur:
@@ -98,17 +136,15 @@ def reset_database():
 
 def delete_rawdata_by_bizkey(biz_key: str):
 
-    url = get_conn_str(DB_NAME)
-    with psycopg.connect(url) as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                    DELETE FROM raw_data WHERE biz_key = %s;
-                    DELETE FROM raw_data_coverage WHERE biz_key = %s;
-                """,
-                (biz_key, biz_key),
-            )
-            conn.commit()
+    conn = get_connection()
+    with conn.transaction(), conn.cursor() as cur:
+        cur.execute(
+            """
+                DELETE FROM raw_data WHERE biz_key = %s;
+                DELETE FROM raw_data_coverage WHERE biz_key = %s;
+            """,
+            (biz_key, biz_key),
+        )
     logger.info(f"Deleted all records with biz_key = {biz_key} from raw_data.")
 
 
@@ -121,42 +157,42 @@ def get_missing_queries(
     """
 
     # substract existing record coverage from raw_query coverage
-    url = get_conn_str(DB_NAME)
+    biz_key, symbols, start_at, stop_at = raw_query
+    with get_connection().cursor() as cur:
+        # fetch the coverage of all symbols in one round trip
+        cur.execute(
+            """
+            SELECT symbol, lower(tstzrange), upper(tstzrange)
+            FROM raw_data_coverage
+            WHERE biz_key = %s AND symbol = ANY(%s) AND tstzrange && tstzrange(%s, %s, '[)')
+            ORDER BY symbol, lower(tstzrange);
+            """,
+            (biz_key, symbols, start_at, stop_at),
+        )
+        rows = cur.fetchall()
+
+    coverages = defaultdict(list)
+    for symbol, existing_start, existing_end in rows:
+        coverages[symbol].append((existing_start, existing_end))
+
     missing = []
-    with psycopg.connect(url) as conn:
-        with conn.cursor() as cur:
-            biz_key, symbols, start_at, stop_at = raw_query
-            for symbol in symbols:
-                cur.execute(
-                    """
-                    SELECT lower(tstzrange), upper(tstzrange)
-                    FROM raw_data_coverage
-                    WHERE biz_key = %s AND symbol = %s AND tstzrange && tstzrange(%s, %s, '[)');
-                    """,
-                    (biz_key, symbol, start_at, stop_at),
-                )
-                rows = cur.fetchall()
-                if not rows:
-                    missing.append((biz_key, symbol, start_at, stop_at))
-                else:
-                    # calculate the missing ranges
-                    current_start = start_at
-                    rows.sort()  # sort by lower bound
-                    for row in rows:
-                        existing_start, existing_end = row
-                        if current_start < existing_start:
-                            missing.append(
-                                (biz_key, symbol, current_start, existing_start)
-                            )
-                        if current_start < existing_end:
-                            current_start = existing_end
-                    if current_start < stop_at:
-                        missing.append((biz_key, symbol, current_start, stop_at))
-    logger.debug(f"Sample missing queries: {missing[:5]}")
+    for symbol in symbols:
+        # calculate the missing ranges, coverages are sorted by lower bound
+        current_start = start_at
+        for existing_start, existing_end in coverages.get(symbol, []):
+            if current_start < existing_start:
+                missing.append((biz_key, symbol, current_start, existing_start))
+            if current_start < existing_end:
+                current_start = existing_end
+        if current_start < stop_at:
+            missing.append((biz_key, symbol, current_start, stop_at))
+    logger.debug("Sample missing queries: %s", missing[:5])
     return missing
 
 
 if __name__ == "__main__":
+    from rich.logging import RichHandler
+
     logger.addHandler(RichHandler(level=logging.DEBUG))
     logger.setLevel(logging.DEBUG)
     logger.debug("Logger initialized.")
@@ -179,95 +215,97 @@ if __name__ == "__main__":
                 logger.debug(f"{row[0]}: {row[1]}")
 
 
-def store_data(
-    query: Tuple[str, List[str], datetime, datetime],
-    transformed_data: list[Tuple[str, str, datetime, datetime, Any]],
+def store_data_many(
+    batches: list[
+        Tuple[
+            Tuple[str, List[str], datetime, datetime],
+            list[Tuple[str, str, datetime, datetime, Any]],
+        ]
+    ],
 ) -> int:
-    """Store the transformed data into the PostgreSQL database.
+    """Store the transformed data of many queries in a single transaction.
 
-    transformed_data: List of tuples (biz_key, symbol, start_at, stop_at, data)
+    batches: List of (query, transformed_data) pairs, where query is (biz_key, symbols, start_at, stop_at)
+        and transformed_data is a list of tuples (biz_key, symbol, start_at, stop_at, data)
     return: number of successfully inserted records
     """
 
-    conn_str = get_conn_str(DB_NAME)
+    transformed_data = [record for _, records in batches for record in records]
     inserted_count = 0
-    with psycopg.connect(conn_str) as conn:
-        with conn.cursor() as cur:
-
-            for record in transformed_data:
-                biz_key, symbol, start_at, stop_at, data = record
-                try:
-                    # Insert into raw_data table
-                    cur.execute(
-                        """
-                        INSERT INTO raw_data (biz_key, symbol, tstzrange, data)
-                        VALUES (%s, %s, tstzrange(%s, %s, '[)'), %s)
-                        ON CONFLICT (biz_key, symbol, tstzrange) DO NOTHING;
-                        """,
-                        (biz_key, symbol, start_at, stop_at, data),
-                    )
-                    if cur.rowcount == 1:
-                        inserted_count += 1
-                except Exception as e:
-                    logger.error(f"Error inserting record {record}: {e}")
-                    raise e
+    conn = get_connection()
+    with conn.transaction(), conn.cursor() as cur:
 
-            # Now update the raw_data_coverage table
-            biz_key, symbols, start_at, stop_at = query
-            # find out all ranges that overlap or are adjacent to the new range
-            cur.execute(
-                """
-                SELECT tstzrange
-                FROM raw_data_coverage
-                WHERE biz_key = %s AND symbol = ANY(%s) AND (tstzrange && tstzrange(%s, %s, '[)') OR tstzrange -|- tstzrange(%s, %s, '[)'));
-                """,
-                (biz_key, symbols, start_at, stop_at, start_at, stop_at),
-            )
-            rows = cur.fetchall()
-            if rows:
-                # merge all these ranges with the new range
-                merged_start = start_at
-                merged_end = stop_at
-                for row in rows:
-                    existing_range = row[0]
-                    existing_start = existing_range.lower
-                    existing_end = existing_range.upper
-                    if existing_start < merged_start:
-                        merged_start = existing_start
-                    if existing_end > merged_end:
-                        merged_end = existing_end
-                # delete the old ranges
+        if transformed_data:
+            try:
+                # COPY all records into a staging table, then move them into
+                # raw_data with a single INSERT, skipping the existing ones
                 cur.execute(
                     """
-                    DELETE FROM raw_data_coverage
-                    WHERE biz_key = %s AND symbol = ANY(%s) AND (tstzrange && tstzrange(%s, %s, '[)') OR tstzrange -|- tstzrange(%s, %s, '[)'));
-                    """,
-                    (biz_key, symbols, start_at, stop_at, start_at, stop_at),
-                )
-                # insert the merged range
-                cur.execute(
+                    CREATE TEMP TABLE raw_data_staging (
+                        biz_key VARCHAR(32) NOT NULL,
+                        symbol VARCHAR(16) NOT NULL,
+                        start_at TIMESTAMPTZ NOT NULL,
+                        stop_at TIMESTAMPTZ NOT NULL,
+                        data JSONB NOT NULL
+                    ) ON COMMIT DROP;
                     """
-                    INSERT INTO raw_data_coverage (biz_key, symbol, tstzrange)
-                    SELECT %s, symbol, tstzrange(%s, %s, '[)')
-                    FROM unnest(%s::varchar[]) AS symbol
-                    ON CONFLICT (biz_key, symbol, tstzrange) DO NOTHING;
-                    """,
-                    (biz_key, merged_start, merged_end, symbols),
                 )
-            else:
-                # simply insert the new range
+                with cur.copy(
+                    "COPY raw_data_staging (biz_key, symbol, start_at, stop_at, data) FROM STDIN"
+                ) as copy:
+                    for record in transformed_data:
+                        copy.write_row(record)
                 cur.execute(
                     """
-                    INSERT INTO raw_data_coverage (biz_key, symbol, tstzrange)
-                    SELECT %s, symbol, tstzrange(%s, %s, '[)')
-                    FROM unnest(%s::varchar[]) AS symbol
+                    INSERT INTO raw_data (biz_key, symbol, tstzrange, data)
+                    SELECT biz_key, symbol, tstzrange(start_at, stop_at, '[)'), data
+                    FROM raw_data_staging s
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM raw_data r
+                        WHERE r.biz_key = s.biz_key AND r.symbol = s.symbol
+                            AND r.tstzrange = tstzrange(s.start_at, s.stop_at, '[)')
+                    )
                     ON CONFLICT (biz_key, symbol, tstzrange) DO NOTHING;
-                    """,
-                    (biz_key, start_at, stop_at, symbols),
+                    """
                 )
+                inserted_count = cur.rowcount
+            except Exception as e:
+                queries = [query for query, _ in batches]
+                logger.error(f"Error inserting records of queries {queries}: {e}")
+                raise e
+
+        # Now update the raw_data_coverage table
+        for query, _ in batches:
+            biz_key, symbols, start_at, stop_at = query
+            # remove all ranges that overlap or are adjacent to the new range,
+            # they are merged into it below
+            cur.execute(
+                """
+                DELETE FROM raw_data_coverage
+                WHERE biz_key = %s AND symbol = ANY(%s) AND (tstzrange && tstzrange(%s, %s, '[)') OR tstzrange -|- tstzrange(%s, %s, '[)'))
+                RETURNING tstzrange;
+                """,
+                (biz_key, symbols, start_at, stop_at, start_at, stop_at),
+            )
+            merged_start = start_at
+            merged_end = stop_at
+            for (existing_range,) in cur.fetchall():
+                if existing_range.lower < merged_start:
+                    merged_start = existing_range.lower
+                if existing_range.upper > merged_end:
+                    merged_end = existing_range.upper
+            # insert the merged range
+            cur.execute(
+                """
+                INSERT INTO raw_data_coverage (biz_key, symbol, tstzrange)
+                SELECT %s, symbol, tstzrange(%s, %s, '[)')
+                FROM unnest(%s::varchar[]) AS symbol
+                ON CONFLICT (biz_key, symbol, tstzrange) DO NOTHING;
+                """,
+                (biz_key, merged_start, merged_end, symbols),
+            )
 
-            conn.commit()
     logger.debug(
-        f"Successfully inserted {inserted_count} / {len(transformed_data)} data."
+        "Successfully inserted %d / %d data.", inserted_count, len(transformed_data)
     )
     return inserted_count
@@ -1,23 +1,58 @@
 import logging
+import math
+import re
+import threading
+import time
 from abc import abstractmethod
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime, timedelta, timezone
+from itertools import islice
 from typing import Callable
 
 import tenacity
-from tushare import pro_api, set_token
 
-from srt.datasource.dbtools import get_missing_queries, store_data
+from srt.datasource import config
+from srt.datasource.dbtools import get_missing_queries, store_data_many
 from srt.datasource.tracker import track
-from srt.datasource.utils import get_symbol_list
-
-from . import config
+from srt.datasource.utils import get_api, get_symbol_list
 
 logger = logging.getLogger(__name__)
 
+STORE_BATCH_SIZE = 10_000  # records written per transaction
+SATURDAY = 5  # datetime.weekday() of Saturday, Sunday is 6
+
+
+def on_weekend(start_at: datetime, stop_at: datetime) -> bool:
+    """Whether every day of the time range [start_at, stop_at) is on a weekend."""
+    last_at = stop_at - timedelta.resolution
+    return (
+        last_at - start_at < timedelta(days=2)
+        and start_at.weekday() >= SATURDAY
+        and last_at.weekday() >= SATURDAY
+    )
+
+
+class RateLimiter:
+    """Space out calls shared by many threads to at most `rate` per second."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self.next_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Block until the next call is allowed."""
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_at - now
+            self.next_at = max(now, self.next_at) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
 
 class API:
     biz_key: str
-    limit_qps: int  # queries per second
+    limit_qps: float  # queries per second
     limit_rpq: int  # records per query
     preference: str = "symbol"  # or "time", or "hybrid"
     frequency: timedelta = timedelta(days=1)
@@ -43,12 +78,11 @@ class TushareAPI(API):
         self,
         api_method: Callable,
         biz_key: str,
-        limit_qps: int = 10,
+        limit_qps: float = 8,
         limit_rpq: int = 6000,
         preference: str = "hybrid",
         frequency: timedelta = timedelta(days=1),
     ):
-        set_token(config.get("tushare", "token"))
         self.biz_key = biz_key
         self.limit_qps = limit_qps
         self.limit_rpq = limit_rpq
@@ -56,30 +90,60 @@ class TushareAPI(API):
         self.frequency = frequency
 
         self.api_method = api_method
-
-    def _transform_record(self, row) -> tuple[str, str, datetime, datetime, str]:
-        timestamp = datetime.strptime(row["trade_date"], "%Y%m%d")
-        timestamp = timestamp.replace(
-            tzinfo=timezone(timedelta(hours=8))
-        )  # Asia/Shanghai
-        return (
-            self.biz_key,  # biz_key
-            row["ts_code"],  # symbol
-            timestamp,  # timestamp
-            timestamp + self.frequency,  # end timestamp
-            row.to_json(),  # data
-        )
+        # shared by the download threads, keeps them within limit_qps
+        self.rate_limiter = RateLimiter(limit_qps)
+
+    def _transform_records(self, df) -> list[tuple[str, str, datetime, datetime, str]]:
+        # parse every distinct trade_date only once, a time-based download
+        # returns a single trade_date for all symbols
+        tz = timezone(timedelta(hours=8))  # Asia/Shanghai
+        timeranges = {}
+        for trade_date in df["trade_date"].unique():
+            timestamp = datetime.strptime(trade_date, "%Y%m%d").replace(tzinfo=tz)
+            timeranges[trade_date] = (timestamp, timestamp + self.frequency)
+        # serialize all rows at once instead of calling row.to_json() per row
+        payloads = df.to_json(orient="records", lines=True).splitlines()
+        return [
+            (
+                self.biz_key,  # biz_key
+                symbol,  # symbol
+                *timeranges[trade_date],  # timestamp, end timestamp
+                data,  # data
+            )
+            for symbol, trade_date, data in zip(
+                df["ts_code"].tolist(), df["trade_date"].tolist(), payloads
+            )
+        ]
 
     @tenacity.retry(
         wait=tenacity.wait_fixed(1),  # wait 1 second between retries
         stop=tenacity.stop_after_attempt(5),  # stop after 5 attempts
         reraise=True,
     )
+    def _query_on_time(self, start_date: str, end_date: str):
+        """Call the pro api for all symbols, retries reuse the formatted dates."""
+        self.rate_limiter.wait()
+        return self.api_method(start_date=start_date, end_date=end_date)
+
+    @tenacity.retry(
+        wait=tenacity.wait_exponential(multiplier=1, min=4, max=60),
+        stop=tenacity.stop_after_attempt(5),
+        reraise=True,
+    )
+    def _query_on_symbol(self, symbol: str, start_date: str, end_date: str):
+        """Call the pro api for one symbol, retries reuse the formatted dates."""
+        self.rate_limiter.wait()
+        return self.api_method(ts_code=symbol, start_date=start_date, end_date=end_date)
+
     def download_on_time(
         self, symbols: list[str], start_at: datetime, stop_at: datetime
     ):
         logger.debug(
-            f"Downloading by time: {symbols[:5]}...({len(symbols) - 5} more), {start_at}, {stop_at}"
+            "Downloading by time: %s...(%d more), %s, %s",
+            symbols[:5],
+            len(symbols) - 5,
+            start_at,
+            stop_at,
         )
         if stop_at - start_at > self.frequency:
             logger.error("Date range too large for time-based download")
@@ -87,37 +151,28 @@ class TushareAPI(API):
                 f"start_at: {start_at}, stop_at: {stop_at}, frequency: {self.frequency}"
             )
             raise ValueError("Date range too large for time-based download")
-        df = self.api_method(
-            start_date=start_at.strftime("%Y%m%d"),
-            end_date=stop_at.strftime("%Y%m%d"),
+        if on_weekend(start_at, stop_at):
+            # the exchanges are closed, save the api call
+            return []
+        df = self._query_on_time(
+            start_at.strftime("%Y%m%d"), stop_at.strftime("%Y%m%d")
         )
 
         records = []
         if df is not None and not df.empty:
             # filter out all symbols not in the list
             df = df[df["ts_code"].isin(symbols)]
-            for row in df.iterrows():
-                record = self._transform_record(row[1])
-                records.append(record)
+            records = self._transform_records(df)
         return records
 
-    @tenacity.retry(
-        wait=tenacity.wait_exponential(multiplier=1, min=4, max=60),
-        stop=tenacity.stop_after_attempt(5),
-        reraise=True,
-    )
     def download_on_symbol(self, symbol: str, start_at: datetime, stop_at: datetime):
-        logger.debug(f"Downloading by symbol: {symbol}, {start_at}, {stop_at}")
-        df = self.api_method(
-            ts_code=symbol,
-            start_date=start_at.strftime("%Y%m%d"),
-            end_date=stop_at.strftime("%Y%m%d"),
+        logger.debug("Downloading by symbol: %s, %s, %s", symbol, start_at, stop_at)
+        df = self._query_on_symbol(
+            symbol, start_at.strftime("%Y%m%d"), stop_at.strftime("%Y%m%d")
         )
         records = []
         if df is not None and not df.empty:
-            for row in df.iterrows():
-                record = self._transform_record(row[1])
-                records.append(record)
+            records = self._transform_records(df)
         return records
 
 
@@ -146,6 +201,18 @@ def merge_missing_queries(
     elif api.preference == "time":
         return merge_timeranges(api, missing_queries)
     elif api.preference == "hybrid":
+        # skip the comparison when one side cannot lose
+        if len({symbol for _, symbol, _, _ in missing_queries}) == 1:
+            # a single symbol: merging by symbol only cuts its ranges into chunks
+            return merge_timeranges(api, missing_queries)
+        timeranges = {
+            (start_at, stop_at) for _, _, start_at, stop_at in missing_queries
+        }
+        if len(timeranges) == 1:
+            start_at, stop_at = timeranges.pop()
+            if stop_at - start_at <= api.frequency:
+                # a single chunk of time: merging by symbol yields one query
+                return merge_symbols(api, missing_queries)
         queries_with_symbol_merged = merge_symbols(api, missing_queries)
         queries_with_time_merged = merge_timeranges(api, missing_queries)
         if len(queries_with_symbol_merged) <= len(queries_with_time_merged):
@@ -165,29 +232,26 @@ def merge_symbols(
     If merging the next query exceeds api.limit_rpq, start a new merged query.
     """
 
+    frequency = api.frequency
     chuncked_queries = {}
     for biz_key, symbol, start_at, stop_at in missing_queries:
         current_start = start_at
         while current_start < stop_at:
-            current_end = min(current_start + api.frequency, stop_at)
+            current_end = min(current_start + frequency, stop_at)
             key = (biz_key, current_start, current_end)
-            if key not in chuncked_queries:
-                chuncked_queries[key] = []
-            chuncked_queries[key].append(symbol)
+            chuncked_queries.setdefault(key, []).append(symbol)
             current_start = current_end
 
     merged_queries = []
     current_query = None
     for (biz_key, start_at, stop_at), symbols in sorted(chuncked_queries.items()):
-        if current_query is None:
-            current_query = (biz_key, symbols, start_at, stop_at)
-        else:
+        if current_query is not None:
             current_biz_key, current_symbols, current_start_at, current_stop_at = (
                 current_query
             )
             # if the same time chunk and not exceeds limit
-            estimated_size = len(current_symbols + symbols) * (
-                (current_stop_at - current_start_at) // api.frequency
+            estimated_size = (len(current_symbols) + len(symbols)) * (
+                (current_stop_at - current_start_at) // frequency
             )
             if (
                 biz_key == current_biz_key
@@ -195,17 +259,12 @@ def merge_symbols(
                 and stop_at == current_stop_at
                 and estimated_size <= api.limit_rpq
             ):
-                # merge into current query
-                current_query = (
-                    current_biz_key,
-                    current_symbols + symbols,
-                    current_start_at,
-                    current_stop_at,
-                )
-            else:
-                # save current query and start a new one
-                merged_queries.append(current_query)
-                current_query = (biz_key, symbols, start_at, stop_at)
+                # merge into current query, in place
+                current_symbols.extend(symbols)
+                continue
+            # save current query and start a new one
+            merged_queries.append(current_query)
+        current_query = (biz_key, symbols, start_at, stop_at)
     if current_query is not None:
         merged_queries.append(current_query)
 
@@ -258,7 +317,36 @@ def merge_timeranges(
     return merged_queries
 
 
+def _download_query(
+    api: API, query: tuple[str, list[str], datetime, datetime]
+) -> list[tuple[str, str, datetime, datetime, str]]:
+    """Download all records of a merged query."""
+    biz_key, symbols, start_at, stop_at = query
+    logger.info(
+        f"Downloading data for {len(symbols)} symbols from {start_at} to {stop_at}..."
+    )
+    if api.preference == "symbol":
+        records = []
+        for symbol in symbols:
+            records.extend(api.download_on_symbol(symbol, start_at, stop_at))
+        return records
+    elif api.preference == "time":
+        return api.download_on_time(symbols, start_at, stop_at)
+    elif api.preference == "hybrid":
+        num_symbols = len(symbols)
+        if num_symbols == 1:
+            return api.download_on_symbol(symbols[0], start_at, stop_at)
+        elif num_symbols > 1:  # by time
+            return api.download_on_time(symbols, start_at, stop_at)
+        else:
+            raise ValueError("No symbols to download")
+    else:
+        raise ValueError(f"Unknown preference: {api.preference}")
+
+
 def _download(api: API, symbols: list[str], start_at: datetime, stop_at: datetime):
+    # drop repeated symbols, keep the given order
+    symbols = list(dict.fromkeys(symbols))
     stop_at = min(datetime.now(tz=stop_at.tzinfo), stop_at)
     start_at = max(start_at, datetime(1989, 1, 1, tzinfo=start_at.tzinfo))
     if start_at >= stop_at:
@@ -266,51 +354,79 @@ def _download(api: API, symbols: list[str], start_at: datetime, stop_at: datetim
         return
     query = (api.biz_key, symbols, start_at, stop_at)
     logger.debug(
-        f"Downloading with query: {api.biz_key}, {symbols[:5]}...({len(symbols) - 5} more), {start_at}, {stop_at}"
+        "Downloading with query: %s, %s...(%d more), %s, %s",
+        api.biz_key,
+        symbols[:5],
+        len(symbols) - 5,
+        start_at,
+        stop_at,
     )
     missing_queries = get_missing_queries(query)
-    logger.debug(f"Sample missing queries: {missing_queries[:5]}")
+    if not missing_queries:
+        logger.info("Data is already up to date.")
+        return
     merged_missing_queries = merge_missing_queries(api, missing_queries)
-    logger.debug(f"Sample merged missing queries: {merged_missing_queries[:5]}")
-
-    for query in track(merged_missing_queries):
-        biz_key, symbols, start_at, stop_at = query
-        logger.info(
-            f"Downloading data for {len(symbols)} symbols from {start_at} to {stop_at}..."
-        )
-        if api.preference == "symbol":
-            for symbol in symbols:
-                records = api.download_on_symbol(symbol, start_at, stop_at)
-                store_data(query, records)
-        elif api.preference == "time":
-            records = api.download_on_time(symbols, start_at, stop_at)
-            store_data(query, records)
-        elif api.preference == "hybrid":
-            num_symbols = len(symbols)
-            if num_symbols == 1:
-                records = api.download_on_symbol(symbols[0], start_at, stop_at)
-                store_data(query, records)
-            elif num_symbols > 1:  # by time
-                records = api.download_on_time(symbols, start_at, stop_at)
-                store_data(query, records)
-            else:
-                raise ValueError("No symbols to download")
-        else:
-            raise ValueError(f"Unknown preference: {api.preference}")
+    logger.debug("Sample merged missing queries: %s", merged_missing_queries[:5])
+    if api.preference == "symbol":
+        # a symbol query costs one api call per symbol, give every symbol its
+        # own task so that the calls run in parallel on the pool
+        merged_missing_queries = [
+            (biz_key, [symbol], start_at, stop_at)
+            for biz_key, symbols, start_at, stop_at in merged_missing_queries
+            for symbol in symbols
+        ]
+
+    # The API calls are I/O bound, so run them in a thread pool bounded by the
+    # api's qps limit. Records are stored from this thread only.
+    max_workers = max(1, math.ceil(api.limit_qps))
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    # buffer the results, one transaction per STORE_BATCH_SIZE records
+    # instead of one per query
+    batches, num_records = [], 0
+    try:
+        # keep a window of queries in flight, so downloaded records cannot
+        # pile up in memory faster than they are stored
+        pending_queries = iter(merged_missing_queries)
+        futures = {
+            executor.submit(_download_query, api, query): query
+            for query in islice(pending_queries, 2 * max_workers)
+        }
+        for _ in track(merged_missing_queries):
+            future = wait(futures, return_when=FIRST_COMPLETED).done.pop()
+            query = futures.pop(future)
+            for next_query in islice(pending_queries, 1):
+                futures[executor.submit(_download_query, api, next_query)] = next_query
+            records = future.result()
+            batches.append((query, records))
+            num_records += len(records)
+            if num_records >= STORE_BATCH_SIZE:
+                stored, batches, num_records = batches, [], 0
+                store_data_many(stored)
+    except BaseException:
+        # the buffered queries are complete, each with its own coverage,
+        # store them so they are not downloaded again on the next run
+        if batches:
+            store_data_many(batches)
+        raise
+    else:
+        if batches:
+            store_data_many(batches)
+    finally:
+        executor.shutdown(cancel_futures=True)
 
 
-api = pro_api()
+# "method" is the name of the method of the Tushare pro api
 TUSHARE_AVAILABLE_DATASETS = {
     "daily": {
-        "method": api.daily,
+        "method": "daily",
         "symbol_type": "stock",
     },
     "daily_basic": {
-        "method": api.daily_basic,
+        "method": "daily_basic",
         "symbol_type": "stock",
     },
     "moneyflow": {
-        "method": api.moneyflow,
+        "method": "moneyflow",
         "symbol_type": "stock",
     },
 }
@@ -324,11 +440,12 @@ def tushare_download(
     if dataset not in TUSHARE_AVAILABLE_DATASETS:
         raise ValueError(f"Unknown dataset: {dataset}")
     dataset_info = TUSHARE_AVAILABLE_DATASETS[dataset]
-    api_method = dataset_info["method"]
+    api_method = getattr(get_api(), dataset_info["method"])
     api = TushareAPI(
         api_method=api_method,
         biz_key=biz_key,
-        limit_qps=10,
+        # Tushare's quotas are per minute
+        limit_qps=config.getint("tushare", "calls_per_minute") / 60,
         limit_rpq=6000,
         preference="hybrid",
         frequency=timedelta(days=1),
@@ -340,12 +457,12 @@ def tushare_download(
 
 
 AVAILABLE_PROVIDER = {"tushare": tushare_download}
+BIZ_KEY_PATTERN = re.compile(r"^[a-zA-Z0-9_]+_[a-zA-Z0-9_]+$")  # <provider>_<dataset>
 
 
 def download(biz_key: str, symbols: list[str], start_at: datetime, stop_at: datetime):
-    import re
-
-    re.match(r"^[a-zA-Z0-9_]+_[a-zA-Z0-9_]+$", biz_key) or ValueError("Invalid biz_key")
+    if not BIZ_KEY_PATTERN.match(biz_key):
+        raise ValueError(f"Invalid biz_key: {biz_key}")
 
     provider, dataset = biz_key.split("_", 1)
 
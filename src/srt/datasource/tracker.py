@@ -58,6 +58,11 @@ def track(
 
     """
 
+    if disable:
+        # nothing is displayed, skip building the Progress
+        yield from sequence
+        return
+
     columns: List[ProgressColumn] = (
         [TextColumn("[progress.description]{task.description}")] if description else []
     )
@@ -1,16 +1,70 @@
+import json
 import logging
-from datetime import datetime
-from zoneinfo import ZoneInfo
+import os
+import tempfile
+import time
+from functools import lru_cache
+from pathlib import Path
 
 import tenacity
-from tushare import pro_api, set_token
 
 from srt.datasource import config
 
 logger = logging.getLogger(__name__)
 
-set_token(config.get("tushare", "token"))
-api = pro_api()
+
+@lru_cache(maxsize=1)
+def get_api():
+    """Return the Tushare pro api, created on first use.
+
+    tushare is imported lazily, importing this module stays cheap for the database-only code paths.
+    """
+    from tushare import pro_api, set_token
+
+    set_token(config.get("tushare", "token"))
+    return pro_api()
+
+
+AVAILABLE_SYMBOL_TYPES = frozenset({"index", "fund", "stock"})
+
+# on-disk cache of the symbol lists, they change at most once a day
+symbol_list_cache_dir = Path.home() / ".cache" / "srt"
+
+
+@lru_cache(maxsize=None)
+def get_symbol_list(symbol_type: str) -> list:
+    """
+    Return the list of stock symbols of symbol_type.
+
+    The list is fetched from Tushare and cached on disk for tushare.symbol_list_ttl seconds,
+    the file's mtime decides when it is fetched again. It is also kept in memory for the
+    rest of the process, so repeated calls skip even the file read.
+    """
+
+    if symbol_type not in AVAILABLE_SYMBOL_TYPES:
+        raise ValueError(
+            f"Invalid symbol_type. Available options are: {', '.join(AVAILABLE_SYMBOL_TYPES)}"
+        )
+
+    cache_file = symbol_list_cache_dir / f"{symbol_type}_basic.json"
+    ttl = config.getint("tushare", "symbol_list_ttl")
+    if cache_file.exists() and time.time() - cache_file.stat().st_mtime < ttl:
+        logger.debug("Loading %s list from %s.", symbol_type, cache_file)
+        try:
+            return json.loads(cache_file.read_text())
+        except ValueError:
+            logger.warning("Ignoring the corrupted cache file %s.", cache_file)
+
+    symbols = _fetch_symbol_list(symbol_type)
+    symbol_list_cache_dir.mkdir(parents=True, exist_ok=True)
+    # write to a temp file and move it in place, so that a concurrent process
+    # never reads a partially written list
+    with tempfile.NamedTemporaryFile(
+        "w", dir=symbol_list_cache_dir, suffix=".tmp", delete=False
+    ) as f:
+        json.dump(symbols, f)
+    os.replace(f.name, cache_file)
+    return symbols
 
 
 @tenacity.retry(
@@ -18,24 +72,13 @@ api = pro_api()
     stop=tenacity.stop_after_attempt(5),
     before=tenacity.before_log(logger, logging.DEBUG),
 )
-def get_symbol_list(symbol_type: str) -> list:
+def _fetch_symbol_list(symbol_type: str) -> list:
     """
     Fetch the stock list from Tushare and return a list of stock symbols.
     """
 
-    available_symbol_types = {
-        "index",
-        "fund",
-        "stock",
-    }
-
-    if symbol_type not in available_symbol_types:
-        raise ValueError(
-            f"Invalid symbol_type. Available options are: {', '.join(available_symbol_types)}"
-        )
-
     logger.debug("Fetching stock list from Tushare...")
-    df = api.query(
+    df = get_api().query(
         symbol_type + "_basic",
         exchange="",
         list_status="L",
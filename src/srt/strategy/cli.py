@@ -1,11 +1,8 @@
 import logging
 from datetime import datetime, timedelta
-from zoneinfo import ZoneInfo
 
 import click
 
-from srt import config
-
 logger = logging.getLogger(__name__)
 
 
@@ -14,13 +11,6 @@ def cli():
     pass
 
 
-def set_timezone(dt):
-    if dt.tzinfo is None:
-        tz = ZoneInfo(config.get("app", "timezone", fallback="Asia/Shanghai"))
-        dt = dt.replace(tzinfo=tz)
-    return dt
-
-
 @cli.command(name="backtest")
 @click.argument(
     "strategy", required=True, type=click.Choice(["pyramid"], case_sensitive=False)
@@ -31,14 +21,14 @@ def set_timezone(dt):
     required=True,
     type=click.DateTime(formats=["%Y-%m-%d"]),
     help="Start date in YYYY-MM-DD format",
-    default=(datetime.now() - timedelta(days=5 * 365)).strftime("%Y-%m-%d"),
+    default=lambda: (datetime.now() - timedelta(days=5 * 365)).strftime("%Y-%m-%d"),
 )
 @click.option(
     "--end-at",
     required=True,
     type=click.DateTime(formats=["%Y-%m-%d"]),
     help="End date in YYYY-MM-DD format",
-    default=datetime.now().strftime("%Y-%m-%d"),
+    default=lambda: datetime.now().strftime("%Y-%m-%d"),
 )
 @click.option("-o", "--optimize", is_flag=True, help="Run optimization")
 def backtest_(strategy, symbol, start_at, end_at, optimize):
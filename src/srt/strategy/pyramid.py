@@ -1,5 +1,4 @@
 import logging
-import pprint
 
 import numpy as np
 
@@ -15,30 +14,27 @@ from srt.datasource.datasource import TushareDatasource
 
 
 def pyramid_buy_sell_point(series, n):
-    """Return buy and sell points for pyramid strategy."""
-    buy_points = np.zeros(series.shape).tolist()
-    sell_points = np.zeros(series.shape).tolist()
-    pivot_price = series[0]
-    for i, price in enumerate(series):
-        buy_points[i] = sell_points[i] = None
+    """Return buy and sell points for pyramid strategy, NaN where there is none."""
+    prices = np.asarray(series, dtype=np.float64)
+    # the pivot walk is sequential, run it on python floats and only
+    # collect the indices, the points are filled in with numpy
+    buy_idxes, sell_idxes = [], []
+    pivot_price = prices[0]
+    for i, price in enumerate(prices.tolist()):
         pct_change = (price - pivot_price) / pivot_price
         if abs(pct_change) >= n:
             pivot_price = price
             if pct_change < 0:
-                buy_points[i] = price
+                buy_idxes.append(i)
             else:
-                sell_points[i] = price
+                sell_idxes.append(i)
+    buy_points = np.full(prices.shape, np.nan)
+    sell_points = np.full(prices.shape, np.nan)
+    buy_points[buy_idxes] = prices[buy_idxes]
+    sell_points[sell_idxes] = prices[sell_idxes]
     return buy_points, sell_points
 
 
-def pyramid_buy_point(series, n):
-    return pyramid_buy_sell_point(series, n)[0]
-
-
-def pyramid_sell_point(series, n):
-    return pyramid_buy_sell_point(series, n)[1]
-
-
 class Pyramid(Strategy):
     """Buy more when lossing every n% percent until no cash left,
     and sell more when winning every n% percent until no position left.
@@ -56,13 +52,23 @@ class Pyramid(Strategy):
 
         self.sma1 = self.I(SMA, self.data.Close, self.period1)
         self.sma2 = self.I(SMA, self.data.Close, self.period2)
+        # sign of sma1 - sma2 of every bar, indexed by bar in next()
+        self.sma_cross = np.sign(np.asarray(self.sma1) - np.asarray(self.sma2))
 
+        # one pivot walk for both indicators
+        buy_points, sell_points = pyramid_buy_sell_point(self.data.Close, self.gap)
         self.pyramid_buy_points = self.I(
-            pyramid_buy_point, self.data.Close, self.gap, scatter=True, overlay=True
+            lambda: buy_points,
+            name=f"pyramid_buy_point({self.gap})",
+            scatter=True,
+            overlay=True,
         )
 
         self.pyramid_sell_points = self.I(
-            pyramid_sell_point, self.data.Close, self.gap, scatter=True, overlay=True
+            lambda: sell_points,
+            name=f"pyramid_sell_point({self.gap})",
+            scatter=True,
+            overlay=True,
         )
 
         self.pivot_price = self.data.Close[0]
@@ -74,42 +80,55 @@ class Pyramid(Strategy):
 
         # exponential size for each lot
         self.lot_sizes = [100 * (2**i) for i in range(self.max_lots)]
+        self.buy_weight_total = sum(self.lot_sizes)  # lot sizes of self.buy_idx_list
         self.position_size_list = []
+        self.pos_total = 0  # sum(self.position_size_list), kept in step with it
 
     def next(self):
         # update position_size_list if position size changed outside
-        if abs(self.position.size - sum(self.position_size_list)) < 1e-3:
+        delta = self.position.size - self.pos_total
+        if abs(delta) < 1e-3:
             pass
-        elif self.position.size > sum(self.position_size_list):  # bought
-            self.position_size_list.append(
-                self.position.size - sum(self.position_size_list)
-            )
+        elif delta > 0:  # bought
+            self.position_size_list.append(delta)
             self.position_size_list.sort()
-        elif self.position.size < sum(self.position_size_list):  # sold
+            self.pos_total = self.position.size
+        else:  # sold
             # always sell the smallest lot
-            self.position_size_list.pop(0)
+            self.pos_total -= self.position_size_list.pop(0)
 
-        pct_change = (self.data.Close[-1] - self.pivot_price) / self.pivot_price
+        close = self.data.Close[-1]
+        pct_change = (close - self.pivot_price) / self.pivot_price
 
         if abs(pct_change) >= self.gap:
             logger.debug(
-                f"Current position size: {self.position.size}, position_size_list: {self.position_size_list}"
+                "Current position size: %s, position_size_list: %s",
+                self.position.size,
+                self.position_size_list,
             )
             logger.debug(
-                f"buy_idx_list: {self.buy_idx_list}, sell_idx_list: {self.sell_idx_list}"
+                "buy_idx_list: %s, sell_idx_list: %s",
+                self.buy_idx_list,
+                self.sell_idx_list,
             )
             logger.debug(
-                f"pct_change: {pct_change:.2%}, pivot_price: {self.pivot_price}, current price: {self.data.Close[-1]}"
+                "pct_change: %.2f%%, pivot_price: %s, current price: %s",
+                pct_change * 100,
+                self.pivot_price,
+                close,
             )
             logger.debug(
-                f"Price change {pct_change:.2%} reached threshold {self.gap:.2%}, pivot_price: {self.pivot_price}, current price: {self.data.Close[-1]}"
+                "Price change %.2f%% reached threshold %.2f%%, pivot_price: %s, current price: %s",
+                pct_change * 100,
+                self.gap * 100,
+                self.pivot_price,
+                close,
             )
-            self.pivot_price = self.data.Close[-1]
+            self.pivot_price = close
 
-            logger.debug(f"sma1: {self.sma1[-1]}, sma2: {self.sma2[-1]}")
-            if (
-                self.sma1[-1] < self.sma2[-1] and pct_change < 0
-            ):  # price going down, buy more
+            logger.debug("sma1: %s, sma2: %s", self.sma1[-1], self.sma2[-1])
+            sma_cross = self.sma_cross[len(self.data) - 1]
+            if sma_cross < 0 and pct_change < 0:  # price going down, buy more
                 if len(self.buy_idx_list) > 0:
                     buy_idx = self.buy_idx_list.pop(
                         0
@@ -118,32 +137,29 @@ class Pyramid(Strategy):
                     self.sell_idx_list.sort()
 
                     # self.position.close()
-                    size = self.lot_sizes[buy_idx] / sum(
-                        [self.lot_sizes[i] for i in self.buy_idx_list + [buy_idx]]
-                    )
+                    size = self.lot_sizes[buy_idx] / self.buy_weight_total
+                    self.buy_weight_total -= self.lot_sizes[buy_idx]
                     if size == 1:
                         size -= 1e-9  # to avoid full cash used error
-                    logger.debug(f"Buy size(in liquidity percentage): {size}")
+                    logger.debug("Buy size(in liquidity percentage): %s", size)
                     order = self.buy(size=size)
-                    logger.debug(f"Buy order: {order}")
-            elif (
-                self.sma1[-1] > self.sma2[-1] and pct_change > 0
-            ):  # price going up, sell more
+                    logger.debug("Buy order: %s", order)
+            elif sma_cross > 0 and pct_change > 0:  # price going up, sell more
                 if len(self.sell_idx_list) > 0 and len(self.position_size_list) > 0:
-                    logger.debug(f"Sell position_size_list: {self.position_size_list}")
+                    logger.debug("Sell position_size_list: %s", self.position_size_list)
                     sell_idx = self.sell_idx_list.pop(
                         0
                     )  # always sell the smallest available slot
                     self.buy_idx_list.append(sell_idx)
                     self.buy_idx_list.sort()
+                    self.buy_weight_total += self.lot_sizes[sell_idx]
 
-                    self.position.close(
-                        self.position_size_list[0] / sum(self.position_size_list)
-                    )
-                    self.position_size_list.pop(0)
+                    self.position.close(self.position_size_list[0] / self.pos_total)
+                    self.pos_total -= self.position_size_list.pop(0)
                     # self.sell(size=self.position_size_list.pop(0))
 
 
+import bisect
 import heapq
 
 
@@ -153,18 +169,18 @@ class NaivePyramid(Strategy):
     sell_gap = 0.05  # threshold percent for each sell
 
     def init(self):
-        self.buy_idxes = list(range(self.max_lots))
+        self.buy_idxes = list(range(self.max_lots))  # sorted, already a heap
         self.sell_idxes = []
-        self.position_size_list = []
+        self.position_size_list = []  # kept sorted, smallest lot first
 
         self.buy_min_price = None
         self.sell_max_price = None
 
         self.lot_weights = [i + 1 for i in range(self.max_lots)]
 
-        heapq.heapify(self.buy_idxes)
-        heapq.heapify(self.sell_idxes)
-        heapq.heapify(self.position_size_list)
+        # running sums, kept in step with the lists instead of summing them
+        self.pos_total = 0  # sum(self.position_size_list)
+        self.buy_weight_total = sum(self.lot_weights)  # weights of self.buy_idxes
 
     def pyramid_buy(self):
         if (
@@ -178,14 +194,13 @@ class NaivePyramid(Strategy):
             return
         buy_idx = heapq.heappop(self.buy_idxes)
         heapq.heappush(self.sell_idxes, buy_idx)
-        used_pct = self.lot_weights[buy_idx] / sum(
-            [self.lot_weights[i] for i in self.buy_idxes + [buy_idx]]
-        )
+        used_pct = self.lot_weights[buy_idx] / self.buy_weight_total
+        self.buy_weight_total -= self.lot_weights[buy_idx]
         if used_pct == 1:
             used_pct -= 1e-9
         order = self.buy(size=used_pct)
         logger.debug(
-            f"Buy order: {order}, position_size_list: {self.position_size_list}"
+            "Buy order: %s, position_size_list: %s", order, self.position_size_list
         )
 
     def pyramid_sell(self):
@@ -201,31 +216,34 @@ class NaivePyramid(Strategy):
             return
         sell_idx = heapq.heappop(self.sell_idxes)
         heapq.heappush(self.buy_idxes, sell_idx)
-        sell_size = heapq.heappop(self.position_size_list)
-        heapq.heappush(self.position_size_list, sell_size)  # push back temporarily
-        self.position.close(sell_size / sum(self.position_size_list))
+        self.buy_weight_total += self.lot_weights[sell_idx]
+        sell_size = self.position_size_list[0]  # the smallest lot
+        self.position.close(sell_size / self.pos_total)
         logger.debug(
-            f"Sell size: {sell_size}, position_size_list: {self.position_size_list}"
+            "Sell size: %s, position_size_list: %s",
+            sell_size,
+            self.position_size_list,
         )
 
     def pyramid_update(self):
         if (
-            self.position.size - sum(self.position_size_list) > 1e-3
+            self.position.size - self.pos_total > 1e-3
         ):  # bought success, sell available.
-            heapq.heappush(
-                self.position_size_list,
-                self.position.size - sum(self.position_size_list),
-            )
+            bisect.insort(self.position_size_list, self.position.size - self.pos_total)
+            self.pos_total = self.position.size
             self.buy_min_price = (
                 self.data.Open[-1]
                 if self.buy_min_price is None
                 else min(self.buy_min_price, self.data.Open[-1])
             )
             logger.debug(
-                f"Buy success, new position_size_list: {self.position_size_list}, buy_min_price: {self.buy_min_price}, sell_max_price: {self.sell_max_price}"
+                "Buy success, new position_size_list: %s, buy_min_price: %s, sell_max_price: %s",
+                self.position_size_list,
+                self.buy_min_price,
+                self.sell_max_price,
             )
-        elif sum(self.position_size_list) - self.position.size > 1e-3:
-            heapq.heappop(self.position_size_list)
+        elif self.pos_total - self.position.size > 1e-3:
+            self.pos_total -= self.position_size_list.pop(0)
             self.sell_max_price = (
                 self.data.Open[-1]
                 if self.sell_max_price is None
@@ -235,7 +253,10 @@ class NaivePyramid(Strategy):
                 self.buy_min_price = None
                 self.sell_max_price = None
             logger.debug(
-                f"Sell success, new position_size_list: {self.position_size_list}, buy_min_price: {self.buy_min_price}, sell_max_price: {self.sell_max_price}"
+                "Sell success, new position_size_list: %s, buy_min_price: %s, sell_max_price: %s",
+                self.position_size_list,
+                self.buy_min_price,
+                self.sell_max_price,
             )
 
     def next(self):
@@ -252,19 +273,21 @@ class SimplePyramid(NaivePyramid):
 
     def init(self):
         super().init()
+        # one float64 C-contiguous copy of Close serves all the talib calls
+        close = np.ascontiguousarray(self.data.Close, dtype=np.float64)
         self.bbands_upper, self.bbands_middle, self.bbands_lower = self.I(
             talib.BBANDS,
-            self.data.Close,
+            close,
             timeperiod=20,
             nbdevup=2,
             nbdevdn=2,
             matype=0,
             overlay=True,
         )
-        self.rsi = self.I(talib.RSI, self.data.Close, timeperiod=14, overlay=False)
+        self.rsi = self.I(talib.RSI, close, timeperiod=14, overlay=False)
         self.macd, self.macd_signal, self.macd_hist = self.I(
             talib.MACD,
-            self.data.Close,
+            close,
             fastperiod=12,
             slowperiod=26,
             signalperiod=9,
@@ -274,12 +297,12 @@ class SimplePyramid(NaivePyramid):
             talib.MFI,
             self.data.High,
             self.data.Low,
-            self.data.Close,
+            close,
             self.data.Volume,
             timeperiod=self.mfi_period,
             overlay=False,
         )
-        self.ma = self.I(talib.MA, self.data.Close, timeperiod=120, overlay=True)
+        self.ma = self.I(talib.MA, close, timeperiod=120, overlay=True)
 
     def next(self):
         # super().next()
@@ -304,9 +327,12 @@ class SimplePyramid(NaivePyramid):
             self.pyramid_sell()
 
 
-def backtest(symbol, start_at, end_at, optimize=False):
-    import numpy as np
+# parameter grid of backtest(optimize=True)
+OPTIMIZE_GAPS = np.arange(0.01, 0.3, 0.01).tolist()
+OPTIMIZE_MAX_LOTS = range(3, 7, 1)
 
+
+def backtest(symbol, start_at, end_at, optimize=False):
     ds = TushareDatasource()
     df = ds.get_stock_price_ohlcv_daily(symbol, start_at, end_at)
 
@@ -321,9 +347,9 @@ def backtest(symbol, start_at, end_at, optimize=False):
 
     if optimize:
         stats = bt.optimize(
-            buy_gap=np.arange(0.01, 0.3, 0.01).tolist(),
-            sell_gap=np.arange(0.01, 0.3, 0.01).tolist(),
-            max_lots=range(3, 7, 1),
+            buy_gap=OPTIMIZE_GAPS,
+            sell_gap=OPTIMIZE_GAPS,
+            max_lots=OPTIMIZE_MAX_LOTS,
             maximize="SQN",
         )
     else:
@@ -332,7 +358,7 @@ def backtest(symbol, start_at, end_at, optimize=False):
     print(stats)
     bt.plot(plot_return=True)
 
-    pprint.pprint(stats["_trades"].to_dict(orient="records"))
+    print(stats["_trades"].to_string())
 
 
 if __name__ == "__main__":
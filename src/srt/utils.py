@@ -0,0 +1,89 @@
+import configparser
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+import click
+
+from srt import config as app_config
+
+
+def get_timezone(config: configparser.ConfigParser = app_config) -> ZoneInfo:
+    """Return the ZoneInfo of app.timezone in config.
+
+    ZoneInfo caches its instances by key, so the zone file is only loaded once.
+    """
+    return ZoneInfo(config.get("app", "timezone", fallback="Asia/Shanghai"))
+
+
+def set_timezone(
+    dt: datetime, config: configparser.ConfigParser = app_config
+) -> datetime:
+    """Attach app.timezone of config to a naive datetime, aware ones are returned as is."""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=get_timezone(config))
+    return dt
+
+
+def get_or_set_config(
+    config: configparser.ConfigParser,
+    config_dir: Path,
+    config_file: Path,
+    section_option: Optional[str],
+    value: Optional[str],
+):
+    """Show the configuration, or set one option of it and save it to config_file.
+
+    Shared by the `config` commands of the cli groups.
+    """
+    if value is None:
+        if section_option:
+            if "." in section_option:
+                section, option = section_option.split(".", 1)
+            else:
+                section, option = "default", section_option
+            if config.has_section(section) and config.has_option(section, option):
+                current_value = config.get(section, option)
+                click.echo(f"{section}.{option} = {current_value}")
+            else:
+                click.echo(f"Configuration '{section}.{option}' not found.")
+        else:
+            for section in config.sections():
+                click.echo(f"[{section}]")
+                for option in config.options(section):
+                    value = config.get(section, option)
+                    click.echo(f"{option} = {value}")
+                click.echo()
+    else:
+        if section_option:
+            if "." in section_option:
+                section, option = section_option.split(".", 1)
+            else:
+                section, option = "default", section_option
+            if not config.has_section(section):
+                click.echo(f"Section '{section}' does not exist.")
+                return
+            if not config.has_option(section, option):
+                click.echo(f"Option '{option}' does not exist in section '{section}'.")
+                return
+
+            # the loaded config sees the new value right away, while only the
+            # options already in config_file are written back along with it
+            config.set(section, option, value)
+            config_in_file = configparser.ConfigParser()
+            if not config_dir.exists():
+                config_dir.mkdir(parents=True, exist_ok=True)
+            else:
+                config_in_file.read(config_file)
+            if not config_in_file.has_section(section):
+                config_in_file.add_section(section)
+            config_in_file.set(section, option, value)
+            with open(config_file, "w") as f:
+                config_in_file.write(f)
+
+            click.echo(f"Set {section}.{option} = {value} and saved to {config_file}")
+        else:
+            click.echo(
+                "Please specify the configuration option to set in 'section.option' format."
+            )